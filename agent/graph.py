@@ -1,109 +1,187 @@
+import asyncio
+import functools
+import json
+import os
+import re
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import dataclass, field
+
+import groq
+import httpx
 from dotenv import load_dotenv
+from langchain_core.exceptions import OutputParserException
 from langchain_core.globals import set_verbose, set_debug
+from langchain_core.runnables import Runnable
 from langchain_groq.chat_models import ChatGroq
+from langgraph.cache.memory import InMemoryCache
 from langgraph.constants import END
 from langgraph.graph import StateGraph
-from langgraph.prebuilt import create_react_agent
+from langgraph.runtime import Runtime
+from langgraph.types import CachePolicy, Send
+from pydantic import ValidationError
 
-from agent.promt import *
+from agent.prompts import plan_and_architect_prompt, coder_system_prompt
 from agent.states import *
-from agent.tools import write_file, read_file, get_current_directory, list_files
+from agent.tools import write_file, read_file, list_files, safe_path_for_project
 
 _ = load_dotenv()
 
-set_debug(True)
-set_verbose(True)
+# Caps how many coder branches talk to the LLM at once to stay under Groq rate limits.
+MAX_PARALLEL_CODERS = 4
+
+# Debug/verbose tracing dumps every prompt and response to stdout; opt in with AGENT_DEBUG=1.
+_DEBUG = os.getenv("AGENT_DEBUG") == "1"
+set_debug(_DEBUG)
+set_verbose(_DEBUG)
+
+
+@dataclass
+class AgentContext:
+    """Per-run LLM handles; their pooled connections belong to the run's event loop."""
+    llm: ChatGroq
+    llm_json: Runnable
+    react_agent: Runnable | None = None
+    # Created with the context inside the running loop; asyncio primitives bind to one loop.
+    coder_slots: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(MAX_PARALLEL_CODERS))
+
+
+@asynccontextmanager
+async def agent_context():
+    """Opens the Groq client for one run and closes its connections when the run ends."""
+    # Every call goes to the same Groq endpoint; one pooled HTTP/2 client lets
+    # concurrent requests share a single TLS connection.
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+    ) as http_async_client:
+        # The Groq client backs off and retries rate-limited (429) requests itself.
+        llm = ChatGroq(model="openai/gpt-oss-120b", http_async_client=http_async_client, max_retries=5)
+        yield AgentContext(llm=llm, llm_json=llm.bind(response_format={"type": "json_object"}))
+
+
+# Every bound tool ships its schema with each coder LLM call. Steps must review sibling files,
+# so listing and reading stay; get_current_directory only returned a constant.
+coder_tools = [write_file, read_file, list_files]
+
+# Fallbacks used when the LLM reply cannot be parsed; built once and copied on use.
+_DEFAULT_PLAN = Plan(
+    name="Scientific Calculator",
+    description="A colorful scientific calculator",
+    techstack="html,css,javascript",
+    features=["arithmetic", "scientific functions", "colorful UI"],
+    files=[
+        {"path": "index.html", "purpose": "Main HTML structure"},
+        {"path": "styles.css", "purpose": "Styling and layout"},
+        {"path": "script.js", "purpose": "Calculator logic"}
+    ]
+)
+_DEFAULT_TASK_PLAN = TaskPlan(
+    implementation_steps=[
+        {"filepath": "index.html", "task_description": "Create the HTML structure for a scientific calculator with display and button grid"},
+        {"filepath": "styles.css", "task_description": "Add gradient background, style the calculator layout, and create colorful buttons with hover effects"},
+        {"filepath": "script.js", "task_description": "Implement calculator logic with arithmetic and scientific functions"}
+    ]
+)
 
-llm = ChatGroq(model="openai/gpt-oss-120b")
+# Outermost {...} span; the stdlib re has no recursive patterns, so this is greedy.
+_JSON_BLOCK = re.compile(r"\{.*\}", re.S)
 
 
-def planner_agent(state: dict) -> dict:
-    """Converts user prompt into a structured Plan."""
-    user_prompt = state["user_prompt"]
-    from langchain_core.output_parsers.json import SimpleJsonOutputParser
-    
-    prompt_text = planner_prompt(user_prompt)
-    prompt_text += "\n\nRespond with a valid JSON object with these keys: name, description, techstack, features (array), files (array of objects with path and purpose)"
-    
+def parse_json_response(raw: str) -> dict:
+    """Parses a JSON-mode reply, falling back to the outermost {...} block."""
     try:
-        # Try structured output first
-        resp = llm.with_structured_output(Plan).invoke(prompt_text)
-    except:
-        # Fallback: use JSON parser
-        try:
-            parser = SimpleJsonOutputParser()
-            chain = llm | parser
-            resp_dict = chain.invoke(prompt_text)
-            resp = Plan(**resp_dict)
-        except Exception as e:
-            print(f"Planning error: {e}")
-            # Fallback with basic structure
-            resp = Plan(
-                name="Scientific Calculator",
-                description="A colorful scientific calculator",
-                techstack="html,css,javascript",
-                features=["arithmetic", "scientific functions", "colorful UI"],
-                files=[
-                    {"path": "index.html", "purpose": "Main HTML structure"},
-                    {"path": "styles.css", "purpose": "Styling and layout"},
-                    {"path": "script.js", "purpose": "Calculator logic"}
-                ]
-            )
-    
-    if resp is None:
-        raise ValueError("Planner did not return a valid response.")
-    return {"plan": resp}
-
-
-def architect_agent(state: dict) -> dict:
-    """Creates TaskPlan from Plan."""
-    plan: Plan = state["plan"]
-    from langchain_core.output_parsers.json import SimpleJsonOutputParser
-    
-    prompt_text = architect_prompt(plan=plan.model_dump_json())
-    prompt_text += "\n\nRespond with a valid JSON object with key 'implementation_steps' containing an array of tasks with 'filepath' and 'task_description'"
-    
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        match = _JSON_BLOCK.search(raw)
+        if match is None:
+            raise OutputParserException("No JSON object found in LLM response", llm_output=raw)
+        return json.loads(match.group(0))
+
+
+def is_json_validate_failure(error: groq.BadRequestError) -> bool:
+    """Tells whether Groq rejected a JSON-mode reply because the model produced invalid JSON."""
+    body = error.body if isinstance(error.body, dict) else {}
+    details = body.get("error", body)
+    return isinstance(details, dict) and details.get("code") == "json_validate_failed"
+
+
+async def plan_project(state: AgentState, runtime: Runtime[AgentContext]) -> dict:
+    """Converts user prompt into a Plan and its TaskPlan with a single LLM call.
+
+    Raises on an unusable reply; failed runs are never cached, so the next attempt asks the LLM again.
+    """
+    prompt_text = plan_and_architect_prompt(state["user_prompt"])
     try:
-        resp = llm.with_structured_output(TaskPlan).invoke(prompt_text)
-    except:
-        try:
-            parser = SimpleJsonOutputParser()
-            chain = llm | parser
-            resp_dict = chain.invoke(prompt_text)
-            resp = TaskPlan(**resp_dict)
-        except Exception as e:
-            print(f"Architecture error: {e}")
-            # Fallback task plan
-            resp = TaskPlan(
-                implementation_steps=[
-                    {"filepath": "index.html", "task_description": "Create the HTML structure for a scientific calculator with display and button grid"},
-                    {"filepath": "styles.css", "task_description": "Add gradient background, style the calculator layout, and create colorful buttons with hover effects"},
-                    {"filepath": "script.js", "task_description": "Implement calculator logic with arithmetic and scientific functions"}
-                ]
-            )
-    
-    if resp is None:
-        raise ValueError("Architect did not return a valid response.")
-
-    resp.plan = plan
-    return {"task_plan": resp}
-
-
-def coder_agent(state: dict) -> dict:
-    """LangGraph tool-using coder agent."""
-    coder_state: CoderState = state.get("coder_state")
-    if coder_state is None:
-        coder_state = CoderState(task_plan=state["task_plan"], current_step_idx=0)
+        raw = (await runtime.context.llm_json.ainvoke(prompt_text)).content
+    except groq.BadRequestError as e:
+        # JSON mode reports malformed output as a 400 rather than returning the text.
+        if not is_json_validate_failure(e):
+            raise
+        raise OutputParserException(f"LLM returned invalid JSON: {e.message}") from e
+    resp = CombinedOutput.model_validate(parse_json_response(raw))
+    return {"plan": resp.plan, "task_plan": resp.task_plan}
+
+
+planning = StateGraph(AgentState, context_schema=AgentContext)
+# Identical prompts yield identical plans, so skip the LLM round trip on repeats.
+planning.add_node("plan_project", plan_project, cache_policy=CachePolicy(ttl=3600))
+planning.set_entry_point("plan_project")
+planning.add_edge("plan_project", END)
+# In-memory, so hits only come from several run_agent() calls in one process; main.py
+# plans a single prompt per process. Use SqliteCache (langgraph-checkpoint-sqlite) to
+# reuse plans across processes.
+planner = planning.compile(cache=InMemoryCache())
+
+
+async def planner_architect_agent(state: AgentState, runtime: Runtime[AgentContext]) -> dict:
+    """Plans the project, falling back to the default plan outside the cache."""
+    try:
+        result = await planner.ainvoke({"user_prompt": state["user_prompt"]}, context=runtime.context)
+        plan, task_plan = result["plan"], result["task_plan"]
+    except (ValidationError, OutputParserException, json.JSONDecodeError) as e:
+        print(f"Planning error: {e}")
+        plan, task_plan = _DEFAULT_PLAN.model_copy(), _DEFAULT_TASK_PLAN.model_copy()
+
+    # Attached after the cache: extra fields come back from it as plain dicts.
+    task_plan.plan = plan
+    return {"plan": plan, "task_plan": task_plan}
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_read(path: str, mtime_ns: int) -> str:
+    return read_file.invoke({"path": path})
+
+
+def read_project_file(path: str) -> str:
+    """Reads a project file, reusing the last read while its mtime is unchanged."""
+    p = safe_path_for_project(path)
+    return _cached_read(path, p.stat().st_mtime_ns if p.exists() else 0)
+
+
+def get_react_agent(context: AgentContext) -> Runnable:
+    """Builds the coder ReAct agent on first use in a run and reuses it afterwards."""
+    if context.react_agent is None:
+        # langgraph.prebuilt is heavy to import; only pay for it once coding starts.
+        from langgraph.prebuilt import create_react_agent
+        context.react_agent = create_react_agent(context.llm.bind_tools(coder_tools, tool_choice="auto"), coder_tools)
+    return context.react_agent
+
+
+def project_key(path: str) -> str:
+    """Resolves a project path so that spellings like './index.html' and 'index.html' compare equal."""
+    return str(safe_path_for_project(path))
 
-    steps = coder_state.task_plan.implementation_steps
-    if coder_state.current_step_idx >= len(steps):
-        return {"coder_state": coder_state, "status": "DONE"}
 
-    current_task = steps[coder_state.current_step_idx]
+async def run_coder_step(context: AgentContext, coder_state: CoderState, current_task: ImplementationTask) -> None:
+    """Runs the tool-using coder on a single implementation step."""
     try:
-        existing_content = read_file.invoke({"path": current_task.filepath})
-    except:
-        existing_content = ""
+        target = project_key(current_task.filepath)
+        existing_content = coder_state.file_cache.get(target)
+        if existing_content is None:
+            existing_content = read_project_file(current_task.filepath)
+    except (OSError, ValueError):
+        target, existing_content = None, ""
 
     system_prompt = coder_system_prompt()
     user_prompt = (
@@ -113,39 +191,69 @@ def coder_agent(state: dict) -> dict:
         "IMPORTANT: Use the write_file tool to save your implementation!"
     )
 
-    coder_tools = [write_file, read_file, list_files, get_current_directory]
-    
-    # Bind tools to LLM and force tool use
-    llm_with_tools = llm.bind_tools(coder_tools, tool_choice="auto")
-    react_agent = create_react_agent(llm_with_tools, coder_tools)
-
+    react_agent = get_react_agent(context)
+    events = react_agent.astream_events({"messages": [{"role": "system", "content": system_prompt},
+                                                      {"role": "user", "content": user_prompt}]},
+                                        version="v2")
     try:
-        result = react_agent.invoke({"messages": [{"role": "system", "content": system_prompt},
-                                                   {"role": "user", "content": user_prompt}]})
+        async with aclosing(events):
+            async for ev in events:
+                if ev["event"] == "on_tool_end" and ev["name"] == "write_file":
+                    args = ev["data"]["input"]
+                    written = project_key(args["path"])
+                    coder_state.file_cache[written] = args["content"]
+                    # Once the task's file is on disk, skip the model's closing summary turn.
+                    if written == target:
+                        break
     except Exception as e:
-        print(f"Coder agent step {coder_state.current_step_idx}: {str(e)[:200]}")
+        print(f"Coder agent step {current_task.filepath}: {str(e)[:200]}")
+
+
+def dispatch_coders(state: AgentState) -> list[Send]:
+    """Fans out one coder branch per file, keeping each file's steps in order."""
+    steps_by_file: dict[str, list[ImplementationTask]] = {}
+    for step in state["task_plan"].implementation_steps:
+        # Group by resolved path so 'index.html' and './index.html' share one branch.
+        try:
+            key = project_key(step.filepath)
+        except ValueError:
+            key = step.filepath
+        steps_by_file.setdefault(key, []).append(step)
+    return [
+        Send("coder", {"coder_state": CoderState(task_plan=TaskPlan(implementation_steps=steps))})
+        for steps in steps_by_file.values()
+    ]
+
 
-    coder_state.current_step_idx += 1
-    return {"coder_state": coder_state}
+async def coder_agent(state: AgentState, runtime: Runtime[AgentContext]) -> dict:
+    """LangGraph tool-using coder agent for the steps of a single file."""
+    coder_state: CoderState = state["coder_state"]
+    steps = coder_state.task_plan.implementation_steps
+    async with runtime.context.coder_slots:
+        for current_task in steps:
+            await run_coder_step(runtime.context, coder_state, current_task)
+    return {"coded_files": [steps[0].filepath]}
 
 
-graph = StateGraph(dict)
+graph = StateGraph(AgentState, context_schema=AgentContext)
 
-graph.add_node("planner", planner_agent)
-graph.add_node("architect", architect_agent)
+graph.add_node("planner_architect", planner_architect_agent)
 graph.add_node("coder", coder_agent)
 
-graph.add_edge("planner", "architect")
-graph.add_edge("architect", "coder")
-graph.add_conditional_edges(
-    "coder",
-    lambda s: "END" if s.get("status") == "DONE" else "coder",
-    {"END": END, "coder": "coder"}
-)
+graph.add_conditional_edges("planner_architect", dispatch_coders, ["coder"])
+graph.add_edge("coder", END)
 
-graph.set_entry_point("planner")
+graph.set_entry_point("planner_architect")
 agent = graph.compile()
+
+
+async def run_agent(inputs: dict, config: dict | None = None) -> dict:
+    """Runs the agent graph with a Groq client scoped to the current event loop."""
+    async with agent_context() as context:
+        return await agent.ainvoke(inputs, config, context=context)
+
+
 if __name__ == "__main__":
-    result = agent.invoke({"user_prompt": "Create a simple, single-page weather app using HTML, CSS, and vanilla JavaScript. The app should have a search bar to enter a city name and a 'Get Weather' button. When clicked, it should fetch and display the current temperature, weather description, and a matching weather icon from the OpenWeatherMap API. Include basic CSS for a clean, centered card layout and ensure there is an error message if the city is not found"},
-                          {"recursion_limit": 100})
+    result = asyncio.run(run_agent({"user_prompt": "Create a simple, single-page weather app using HTML, CSS, and vanilla JavaScript. The app should have a search bar to enter a city name and a 'Get Weather' button. When clicked, it should fetch and display the current temperature, weather description, and a matching weather icon from the OpenWeatherMap API. Include basic CSS for a clean, centered card layout and ensure there is an error message if the city is not found"},
+                                   {"recursion_limit": 100}))
     print("Final State:", result)
\ No newline at end of file
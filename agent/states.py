@@ -1,4 +1,5 @@
-from typing import Optional
+import operator
+from typing import Annotated, Optional, TypedDict
 
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -32,8 +33,23 @@ class TaskPlan(BaseModel):
     model_config = ConfigDict(extra="allow")
 
 
+class CombinedOutput(BaseModel):
+    plan: Plan = Field(description="The project plan")
+    task_plan: TaskPlan = Field(description="The implementation steps for the plan")
+
+
 class CoderState(BaseModel):
     task_plan: TaskPlan = Field(description="The plan for the task to be implemented")
-    current_step_idx: int = Field(0, description="The index of the current step in the implementation steps")
     current_file_content: Optional[str] = Field(None,
-                                                description="The content of the file currently being edited or created")
\ No newline at end of file
+                                                description="The content of the file currently being edited or created")
+    file_cache: dict[str, str] = Field(default_factory=dict,
+                                       description="Latest known content of files written by earlier steps, keyed by resolved path")
+
+
+class AgentState(TypedDict, total=False):
+    user_prompt: str
+    plan: Plan
+    task_plan: TaskPlan
+    coder_state: CoderState
+    # Parallel coder branches each append the file they handled.
+    coded_files: Annotated[list[str], operator.add]
\ No newline at end of file
@@ -1,8 +1,9 @@
 import argparse
+import asyncio
 import sys
 import traceback
 
-from agent.graph import agent
+from agent.graph import run_agent
 
 
 def main():
@@ -14,10 +15,10 @@ def main():
 
     try:
         user_prompt = input("Enter your project prompt: ")
-        result = agent.invoke(
+        result = asyncio.run(run_agent(
             {"user_prompt": user_prompt},
             {"recursion_limit": args.recursion_limit}
-        )
+        ))
         print("Final State:", result)
     except KeyboardInterrupt:
         print("\nOperation cancelled by user.")